@@ -1,95 +1,332 @@
-from flask import Flask, render_template, redirect, url_for, request
+from flask import Flask, render_template, redirect, url_for, request, g, jsonify, abort, send_from_directory, make_response
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask_caching import Cache
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+import orjson
 import sqlite3
 import os
+import re
+import hashlib
+import tempfile
+import functools
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
-# In app.py, add to your imports:
-from werkzeug.utils import secure_filename 
 
 # --- 0. ENV LOADING ---
 load_dotenv() 
 
 # --- 1. APP CONFIGURATION ---
+class OrjsonProvider(JSONProvider):
+    # orjson encodes in C; sqlite3.Row goes through the default hook so routes can skip dict(row)
+    @staticmethod
+    def default(o):
+        if isinstance(o, sqlite3.Row):
+            # zip pairs values positionally; dict(o) would look each column up by name
+            return dict(zip(o.keys(), o))
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY') 
+# Debug mode is opt-in (FLASK_DEBUG=1 in .env); otherwise Jinja keeps compiled templates and never re-stats them
+DEBUG = os.getenv('FLASK_DEBUG') == '1'
+app.config['TEMPLATES_AUTO_RELOAD'] = DEBUG
 DB_NAME = 'logbook.db'
+# Used only when init_db() seeds a fresh database. Deliberate trade-off: Werkzeug 3.1 defaults to
+# memory-hard scrypt:32768:8:1 (~130ms per hash); 50k-round PBKDF2 is ~6x cheaper per login but
+# much weaker against offline cracking if logbook.db leaks. Existing hashes are never rewritten.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
 
 # --- 2. LOGIN MANAGER SETUP ---
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# --- PAGE CACHE SETUP ---
+# SimpleCache is per-process; switch CACHE_TYPE to 'RedisCache' when running several workers
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 300})
+
+def page_cache_key(page):
+    # Keyed by the ETag conditional_page() computed (viewer + page_version), so a body is only
+    # ever served under the version that was read before it was rendered; requests without
+    # one are kept out of the cache by page_cache_skipped()
+    return lambda: f"{page}:{g.get('page_etag')}"
+
+def page_cache_skipped():
+    # Only GET/HEAD requests that went through conditional_page() have an ETag to key on
+    return g.get('page_etag') is None
+
+def invalidate_page_cache(conn, page):
+    # Call inside the write's transaction; the new version retires every cached copy and ETag
+    conn.execute(SQL['bump_page_version'], (page,))
+
+def build_token():
+    # Changes whenever app.py or a template is redeployed, so HTML from an older build never
+    # revalidates as current; identical across workers started from the same tree
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    paths = [__file__] + sorted(entry.path for entry in os.scandir(template_dir))
+    stamp = repr([(path, os.stat(path).st_mtime_ns) for path in paths])
+    return hashlib.sha256(stamp.encode()).hexdigest()[:12]
+
+BUILD_TOKEN = build_token()
+
+def conditional_page(page):
+    # ETag = build + viewer + page_version, so browsers revalidate and unchanged pages answer 304 unrendered
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            version = get_db_connection().execute(SQL['page_version'], (page,)).fetchone()[0]
+            etag = g.page_etag = f'{BUILD_TOKEN}-{current_user.id}-{version}'
+            # If-None-Match uses weak comparison (RFC 9110 13.1.2); proxies such as Nginx's
+            # gzip turn our tag into W/"..." before it comes back
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
+
 # --- New Configuration (near APP CONFIGURATION) ---
 UPLOAD_FOLDER = 'static/uploads' # Directory where images will be saved
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'gif'))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024 # Copy uploads to disk in 1 MiB blocks
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+os.makedirs(UPLOAD_FOLDER, exist_ok=True) # Created once here rather than on every upload
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Reject request bodies over 16 MiB
 
 # Helper function to check file extensions
 def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
+
+# Helper function to save an upload under its SHA-256 (identical photos share one file and URL)
+def save_upload(stream, filename):
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                dst.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    ext = filename.rpartition('.')[2].lower()
+    filepath = f'{UPLOAD_FOLDER}/{digest.hexdigest()}.{ext}'
+    if os.path.exists(filepath):
+        os.unlink(tmp_path)
+    else:
+        os.chmod(tmp_path, 0o644) # mkstemp creates 0600 files
+        os.replace(tmp_path, filepath)
+
+    # The relative path stored as photo_url (static/uploads/<sha256>.jpg)
+    return filepath
+
+# photo_url values that save_upload() can have produced
+UPLOADED_PHOTO_URL = re.compile(rf'{UPLOAD_FOLDER}/[0-9a-f]{{64}}\.(?:{"|".join(ALLOWED_EXTENSIONS)})')
+
+# Helper function to accept a photo_url returned earlier by PUT /upload
+def uploaded_photo_url(value):
+    if value and UPLOADED_PHOTO_URL.fullmatch(value) and os.path.isfile(value):
+        return value
+    return None
 
 # --- DATABASE FUNCTIONS ---
 
+# Route SQL kept as fixed strings so sqlite3's statement cache reuses the compiled statements
+SQL = {
+    'count_users': "SELECT COUNT(*) FROM user",
+    'insert_user': "INSERT INTO user (id, username, password_hash) VALUES (?, ?, ?)",
+    'user_by_id': "SELECT * FROM user WHERE id = ?",
+    'select_users': "SELECT * FROM user",
+    'select_memories': "SELECT * FROM memory ORDER BY date DESC",
+    'select_memories_by_user': "SELECT * FROM memory WHERE user_id = ? ORDER BY date DESC",
+    'select_memory': "SELECT * FROM memory WHERE id = ?",
+    'insert_memory': "INSERT INTO memory (title, story, latitude, longitude, photo_url, date, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    'update_memory': """
+        UPDATE memory SET title = ?, story = ?, latitude = ?, longitude = ?, 
+        photo_url = COALESCE(?, photo_url), date = ? WHERE id = ? AND user_id = ?
+    """,
+    'delete_memory': "DELETE FROM memory WHERE id = ? AND user_id = ?",
+    'insert_memory_rtree': "INSERT INTO memory_rtree (id, minLat, maxLat, minLon, maxLon) VALUES (?, ?, ?, ?, ?)",
+    'update_memory_rtree': "UPDATE memory_rtree SET minLat = ?, maxLat = ?, minLon = ?, maxLon = ? WHERE id = ?",
+    'delete_memory_rtree': "DELETE FROM memory_rtree WHERE id = ?",
+    'memories_in_bbox': """
+        SELECT m.* FROM memory m
+        JOIN memory_rtree r ON m.id = r.id
+        WHERE r.maxLat >= ? AND r.minLat <= ? AND r.maxLon >= ? AND r.minLon <= ?
+        ORDER BY m.date DESC
+    """,
+    # Same box split into two longitude ranges, for views that cross the antimeridian
+    'memories_in_bbox_wrapped': """
+        SELECT m.* FROM memory m
+        JOIN memory_rtree r ON m.id = r.id
+        WHERE r.maxLat >= ? AND r.minLat <= ? AND r.maxLon >= ? AND r.minLon <= 180
+        UNION
+        SELECT m.* FROM memory m
+        JOIN memory_rtree r ON m.id = r.id
+        WHERE r.maxLat >= ? AND r.minLat <= ? AND r.maxLon >= -180 AND r.minLon <= ?
+        ORDER BY date DESC
+    """,
+    'select_appreciations': """
+        SELECT a.id, a.text, u.username as author_name 
+        FROM appreciation a 
+        JOIN user u ON a.author_id = u.id 
+        ORDER BY a.id DESC
+    """,
+    'select_appreciation': "SELECT * FROM appreciation WHERE id = ?",
+    'insert_appreciation': "INSERT INTO appreciation (text, author_id, recipient_id) VALUES (?, ?, ?)",
+    'update_appreciation': "UPDATE appreciation SET text = ? WHERE id = ? AND author_id = ?",
+    'delete_appreciation': "DELETE FROM appreciation WHERE id = ? AND author_id = ?",
+    'page_version': "SELECT version FROM page_version WHERE page = ?",
+    'bump_page_version': "UPDATE page_version SET version = version + 1 WHERE page = ?",
+}
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row 
+    # Reuse one connection per request (load_user + the route share it)
+    conn = g.get('db_conn')
+    if conn is None:
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None,
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # Per-connection setting (journal_mode is persistent and set in init_db). Cache/mmap
+        # sizing is left at the defaults: the connection is closed at teardown, so a bigger
+        # page cache or mmap would never warm up and would only add per-request work.
+        conn.execute('PRAGMA synchronous=NORMAL')
+        g.db_conn = conn
     return conn
 
+@app.teardown_appcontext
+def close_db_connection(exception):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        conn.close()
+
+@contextmanager
+def transaction(conn):
+    # The connection is in autocommit mode, so multi-statement writes are grouped explicitly
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+# Bump when init_db()'s DDL changes so existing databases run it again
+SCHEMA_VERSION = 2
+
 def init_db():
     conn = get_db_connection()
+
+    # Skip the DDL and seeding once this database file is at the current schema version
+    if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        # WAL lets readers proceed while a writer commits; stored in the DB file
+        conn.execute('PRAGMA journal_mode=WAL')
     
-    # 1. Create the MEMORY table (for map pins)
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            story TEXT NOT NULL,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            photo_url TEXT,
-            date DATE NOT NULL,
-            user_id INTEGER NOT NULL
-        )
-    ''')
+        # 1. Create the MEMORY table (for map pins)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                story TEXT NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                photo_url TEXT,
+                date DATE NOT NULL,
+                user_id INTEGER NOT NULL
+            )
+        ''')
     
-    # 2. Create the APPRECIATION table (for the lists)
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS appreciation (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT NOT NULL,
-            author_id INTEGER NOT NULL,
-            recipient_id INTEGER NOT NULL
-        )
-    ''')
+        # 2. Create the APPRECIATION table (for the lists)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS appreciation (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                author_id INTEGER NOT NULL,
+                recipient_id INTEGER NOT NULL
+            )
+        ''')
     
-    # 3. Create the USER table 
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS user (
-            id INTEGER PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-    ''')
+        # 3. Create the USER table 
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user (
+                id INTEGER PRIMARY KEY,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL
+            )
+        ''')
     
-    # Insert initial users if the table is empty
-    cursor = conn.execute("SELECT COUNT(*) FROM user")
-    if cursor.fetchone()[0] == 0:
-        your_pwd_hash = generate_password_hash(os.getenv('YOUR_PASSWORD'))
-        friend_pwd_hash = generate_password_hash(os.getenv('FRIEND_PASSWORD'))
-
-        conn.execute("INSERT INTO user (id, username, password_hash) VALUES (?, ?, ?)", 
-                     (1, 'You', your_pwd_hash))
-        conn.execute("INSERT INTO user (id, username, password_hash) VALUES (?, ?, ?)", 
-                     (2, 'Friend', friend_pwd_hash))
-        
-    conn.commit()
-    conn.close()
+        # 4. Create indexes (home() orders by date, optionally filtered by user)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_memory_date_desc ON memory(date DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_memory_user_date ON memory(user_id, date DESC)')
+    
+        # 5. Create the R*Tree spatial index over memory pins (points, so min == max)
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS memory_rtree USING rtree(
+                id, minLat, maxLat, minLon, maxLon
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO memory_rtree (id, minLat, maxLat, minLon, maxLon)
+            SELECT id, latitude, latitude, longitude, longitude FROM memory
+            WHERE id NOT IN (SELECT id FROM memory_rtree)
+        ''')
+    
+        # 6. Create the PAGE_VERSION table (bumped on every write; the pages' ETag).
+        # Versions start at a random value so a recreated logbook.db doesn't reuse old ETags.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS page_version (
+                page TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO page_version (page, version)
+            VALUES ('home', abs(random() / 2)), ('appreciation', abs(random() / 2))
+        ''')
+    
+        # Insert initial users if the table is empty
+        cursor = conn.execute(SQL['count_users'])
+        if cursor.fetchone()[0] == 0:
+            your_pwd_hash = generate_password_hash(os.getenv('YOUR_PASSWORD'), method=PASSWORD_HASH_METHOD)
+            friend_pwd_hash = generate_password_hash(os.getenv('FRIEND_PASSWORD'), method=PASSWORD_HASH_METHOD)
+
+            with transaction(conn):
+                conn.execute(SQL['insert_user'], (1, 'You', your_pwd_hash))
+                conn.execute(SQL['insert_user'], (2, 'Friend', friend_pwd_hash))
 
-# Run the database initialization when the app starts
-init_db()
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    # Cache the (two) user rows so /login can skip the SELECT
+    users_by_name.clear()
+    users_by_name.update((row['username'], dict(row)) for row in conn.execute(SQL['select_users']))
+
+# username -> user row dict, filled by init_db()
+users_by_name = {}
+
+# Run the database initialization when the app starts (under the debug reloader,
+# only in the serving child, not in the parent process that just watches files)
+if not (__name__ == '__main__' and DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'):
+    with app.app_context():
+        init_db()
 
 
 # --- 3. USER MODEL ---
@@ -101,8 +338,7 @@ class User(UserMixin):
 @login_manager.user_loader
 def load_user(user_id):
     conn = get_db_connection()
-    user_row = conn.execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
-    conn.close()
+    user_row = conn.execute(SQL['user_by_id'], (user_id,)).fetchone()
     if user_row:
         return User(user_row['id'], user_row['username']) 
     return None
@@ -118,13 +354,10 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
-        user_row = conn.execute("SELECT * FROM user WHERE username = ?", (username,)).fetchone()
-        conn.close()
+        user_row = users_by_name.get(username)
         
         if user_row and check_password_hash(user_row['password_hash'], password):
-            user = load_user(user_row['id']) 
-            login_user(user)
+            login_user(User(user_row['id'], user_row['username']))
             return redirect(url_for('home'))
         else:
             return render_template('login.html', error='Invalid credentials')
@@ -139,23 +372,24 @@ def logout():
 
 @app.route('/')
 @login_required
+@conditional_page('home')
+@cache.cached(timeout=60, key_prefix=page_cache_key('home'),
+              unless=lambda: 'user_id' in request.args or page_cache_skipped())
 def home():
     conn = get_db_connection()
     
-    # 1. Fetch the raw memory data (list of Row objects)
-    memories_rows = conn.execute('SELECT * FROM memory ORDER BY date DESC').fetchall()
-    conn.close()
-    
-    # 2. CONVERSION STEP (FIX for JSON serialization error): 
-    # Convert Row objects to serializable dictionaries
-    memories = []
-    for row in memories_rows:
-        memories.append(dict(row)) 
+    # Fetch the memory data (list of Row objects; OrjsonProvider makes them safe for `tojson`)
+    # ?user_id= narrows the map to one friend's pins via idx_memory_user_date
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        memories_rows = conn.execute(SQL['select_memories']).fetchall()
+    else:
+        memories_rows = conn.execute(SQL['select_memories_by_user'], (user_id,)).fetchall()
     
     return render_template(
         'index.html', 
         username=current_user.username or 'Guest',
-        memories=memories # This list is now safe for `tojson`
+        memories=memories_rows
     )
 
 @app.route('/add_memory', methods=['GET', 'POST'])
@@ -176,47 +410,55 @@ def add_memory():
             
             # If the user selected a file and it has an allowed extension
             if file and allowed_file(file.filename):
-                # Secure the filename to prevent directory traversal attacks
-                filename = secure_filename(file.filename)
-                
-                # Create the full file path
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                # Ensure the uploads directory exists
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                
-                # Save the file to the local directory
-                file.save(filepath)
-                
-                # The photo_url stored in the database is the relative path (static/uploads/filename.jpg)
-                photo_url = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                # Stored under its content hash, so the client name never reaches the filesystem
+                photo_url = save_upload(file.stream, file.filename)
+
+        # Otherwise use a photo already sent with PUT /upload
+        if photo_url is None:
+            photo_url = uploaded_photo_url(request.form.get('photo_url'))
         # --- END FILE UPLOAD LOGIC ---
 
         conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO memory (title, story, latitude, longitude, photo_url, date, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (title, story, latitude, longitude, photo_url, date, current_user.id)
-        )
-        conn.commit()
-        conn.close()
+        with transaction(conn):
+            cursor = conn.execute(
+                SQL['insert_memory'],
+                (title, story, latitude, longitude, photo_url, date, current_user.id)
+            )
+            # Mirror the pin into the spatial index
+            conn.execute(
+                SQL['insert_memory_rtree'],
+                (cursor.lastrowid, latitude, latitude, longitude, longitude)
+            )
+            invalidate_page_cache(conn, 'home')
         
         return redirect(url_for('home'))
 
     return render_template('add_memory.html')
 
 
+# --- RAW UPLOAD ROUTE (request body is the image, no multipart parsing) ---
+@app.route('/upload/<filename>', methods=['PUT'])
+@login_required
+def upload(filename):
+    if not allowed_file(filename):
+        abort(400)
+
+    # Pass this back as the photo_url form field of add_memory/edit_memory
+    return jsonify(photo_url=save_upload(request.stream, filename)), 201
+
+
+# --- UPLOADED PHOTOS (content-hashed names never change, so browsers may cache them forever) ---
+@app.route(f'/{UPLOAD_FOLDER}/<path:filename>')
+def uploaded_file(filename):
+    response = send_from_directory(UPLOAD_FOLDER, filename, max_age=31536000)
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/edit_memory/<int:memory_id>', methods=['GET', 'POST'])
 @login_required
 def edit_memory(memory_id):
     conn = get_db_connection()
-    memory = conn.execute('SELECT * FROM memory WHERE id = ?', (memory_id,)).fetchone()
-    
-    # Check ownership
-    if memory is None or memory['user_id'] != current_user.id:
-        conn.close()
-        return redirect(url_for('home')) 
-    
-    # ... (inside edit_memory function) ...
     
     if request.method == 'POST':
         title = request.form['title']
@@ -225,62 +467,97 @@ def edit_memory(memory_id):
         longitude = request.form['longitude']
         date = request.form['date']
         
-        # Start with the existing photo URL
-        photo_url = memory['photo_url'] 
+        # None keeps the existing photo URL (COALESCE in the UPDATE)
+        photo_url = None
 
         # --- FILE UPLOAD LOGIC (Same as add_memory, but updates photo_url) ---
         if 'photo' in request.files:
             file = request.files['photo']
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file.save(filepath)
-                
                 # Update the photo_url with the new file path
-                photo_url = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                photo_url = save_upload(file.stream, file.filename)
+
+        # Otherwise use a photo already sent with PUT /upload
+        if photo_url is None:
+            photo_url = uploaded_photo_url(request.form.get('photo_url'))
         # --- END FILE UPLOAD LOGIC ---
 
-        # Update the database record
-        conn.execute(
-            """
-            UPDATE memory SET title = ?, story = ?, latitude = ?, longitude = ?, 
-            photo_url = ?, date = ? WHERE id = ?
-            """,
-            (title, story, latitude, longitude, photo_url, date, memory_id)
-        )
-        conn.commit()
-        conn.close()
+        # Update the database record; the WHERE clause doubles as the ownership check
+        with transaction(conn):
+            cursor = conn.execute(
+                SQL['update_memory'],
+                (title, story, latitude, longitude, photo_url, date, memory_id, current_user.id)
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    SQL['update_memory_rtree'],
+                    (latitude, latitude, longitude, longitude, memory_id)
+                )
+                invalidate_page_cache(conn, 'home')
         return redirect(url_for('home'))
 
-# ... (rest of the edit_memory function) ...
+    memory = conn.execute(SQL['select_memory'], (memory_id,)).fetchone()
+    
+    # Check ownership
+    if memory is None or memory['user_id'] != current_user.id:
+        return redirect(url_for('home')) 
 
-    conn.close()
-    # Convert Row to dict for the template
-    return render_template('edit_memory.html', memory=dict(memory))
+    return render_template('edit_memory.html', memory=memory)
 
 
 @app.route('/delete_memory/<int:memory_id>', methods=['POST'])
 @login_required
 def delete_memory(memory_id):
     conn = get_db_connection()
-    memory = conn.execute('SELECT user_id FROM memory WHERE id = ?', (memory_id,)).fetchone()
     
-    # Check ownership
-    if memory is None or memory['user_id'] != current_user.id:
-        conn.close()
-        return redirect(url_for('home')) 
-
-    conn.execute('DELETE FROM memory WHERE id = ?', (memory_id,))
-    conn.commit()
-    conn.close()
+    # Only deletes the memory if the current user owns it
+    with transaction(conn):
+        cursor = conn.execute(SQL['delete_memory'], (memory_id, current_user.id))
+        if cursor.rowcount:
+            conn.execute(SQL['delete_memory_rtree'], (memory_id,))
+            invalidate_page_cache(conn, 'home')
     return redirect(url_for('home'))
 
 
+@app.route('/memories_in_bbox')
+@login_required
+def memories_in_bbox():
+    # Bounding box of the current map view: ?s=&w=&n=&e=
+    south = request.args.get('s', type=float)
+    west = request.args.get('w', type=float)
+    north = request.args.get('n', type=float)
+    east = request.args.get('e', type=float)
+    if None in (south, west, north, east):
+        abort(400)
+
+    # Leaflet reports longitudes past +/-180 once the map has wrapped. A view at least 360
+    # degrees wide covers every longitude. Otherwise wrap both edges into [-180, 180); if
+    # west then ends up east of east, the view crosses the antimeridian and is split in two.
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+
+    conn = get_db_connection()
+    if west <= east:
+        memories_rows = conn.execute(
+            SQL['memories_in_bbox'], (south, north, west, east)
+        ).fetchall()
+    else:
+        memories_rows = conn.execute(
+            SQL['memories_in_bbox_wrapped'], (south, north, west, south, north, east)
+        ).fetchall()
+
+    return jsonify(memories_rows)
+
+
 @app.route('/appreciation', methods=['GET', 'POST'])
 @login_required
+@conditional_page('appreciation')
+@cache.cached(timeout=60, key_prefix=page_cache_key('appreciation'),
+              unless=page_cache_skipped)
 def appreciation():
     if request.method == 'POST':
         text = request.form['text']
@@ -288,59 +565,42 @@ def appreciation():
         recipient_id = 1 if author_id == 2 else 2
         
         conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO appreciation (text, author_id, recipient_id) VALUES (?, ?, ?)",
-            (text, author_id, recipient_id)
-        )
-        conn.commit()
-        conn.close()
+        with transaction(conn):
+            conn.execute(SQL['insert_appreciation'], (text, author_id, recipient_id))
+            invalidate_page_cache(conn, 'appreciation')
         
         return redirect(url_for('appreciation'))
     
     conn = get_db_connection()
-    appreciations = conn.execute(
-        """
-        SELECT a.id, a.text, u.username as author_name 
-        FROM appreciation a 
-        JOIN user u ON a.author_id = u.id 
-        ORDER BY a.id DESC
-        """
-    ).fetchall()
-    conn.close()
-    
-    # Convert rows to dicts for the template (good practice, though may not be necessary here)
-    appreciations_list = [dict(row) for row in appreciations]
+    appreciations = conn.execute(SQL['select_appreciations']).fetchall()
 
-    return render_template('appreciation.html', appreciations=appreciations_list)
+    return render_template('appreciation.html', appreciations=appreciations)
 
 # --- EDIT APPRECIATION ROUTE ---
 @app.route('/edit_appreciation/<int:note_id>', methods=['GET', 'POST'])
 @login_required
 def edit_appreciation(note_id):
     conn = get_db_connection()
-    # Fetch the note
-    note = conn.execute('SELECT * FROM appreciation WHERE id = ?', (note_id,)).fetchone()
-
-    # CRUCIAL SECURITY CHECK: Ensure the note exists AND the current user wrote it
-    if note is None or note['author_id'] != current_user.id:
-        conn.close()
-        return redirect(url_for('appreciation'))
     
     if request.method == 'POST':
         new_text = request.form['text']
 
-        # Update the database record
-        conn.execute(
-            "UPDATE appreciation SET text = ? WHERE id = ?",
-            (new_text, note_id)
-        )
-        conn.commit()
-        conn.close()
+        # Update the database record (only matches if the current user wrote the note)
+        with transaction(conn):
+            cursor = conn.execute(SQL['update_appreciation'], (new_text, note_id, current_user.id))
+            if cursor.rowcount:
+                invalidate_page_cache(conn, 'appreciation')
+        return redirect(url_for('appreciation'))
+
+    # Fetch the note
+    note = conn.execute(SQL['select_appreciation'], (note_id,)).fetchone()
+
+    # CRUCIAL SECURITY CHECK: Ensure the note exists AND the current user wrote it
+    if note is None or note['author_id'] != current_user.id:
         return redirect(url_for('appreciation'))
 
-    conn.close()
     # For GET request, render the edit form, pre-filled with the current data
-    return render_template('edit_appreciation.html', note=dict(note))
+    return render_template('edit_appreciation.html', note=note)
 
 
 # --- DELETE APPRECIATION ROUTE ---
@@ -348,21 +608,16 @@ def edit_appreciation(note_id):
 @login_required
 def delete_appreciation(note_id):
     conn = get_db_connection()
-    note = conn.execute('SELECT author_id FROM appreciation WHERE id = ?', (note_id,)).fetchone()
-    
-    # CRUCIAL SECURITY CHECK: Ensure the note exists AND the current user wrote it
-    if note is None or note['author_id'] != current_user.id:
-        conn.close()
-        return redirect(url_for('appreciation')) 
 
-    # Delete the record
-    conn.execute('DELETE FROM appreciation WHERE id = ?', (note_id,))
-    conn.commit()
-    conn.close()
+    # Delete the record (CRUCIAL SECURITY CHECK: only matches if the current user wrote it)
+    with transaction(conn):
+        cursor = conn.execute(SQL['delete_appreciation'], (note_id, current_user.id))
+        if cursor.rowcount:
+            invalidate_page_cache(conn, 'appreciation')
     return redirect(url_for('appreciation'))
 
 
 if __name__ == '__main__':
     # NOTE: You may need to delete the existing 'logbook.db' file 
     # if you change the password in .env and need to re-initialize the users.
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=DEBUG)
\ No newline at end of file